@@ -6,26 +6,35 @@ daily_menu_post.py
 This script posts today’s cafeteria dishes to Rocket.Chat.
 It performs the following tasks:
 
-  1. Locates the weekly speiseplan image using get_this_week_speiseplan().
-  2. Crops today’s two dish images from the weekly image with extract_dishes_today().
-  3. Uploads the dish images to GitHub via upload_to_github().
-  4. Posts the dish images to Rocket.Chat and adds emoji reactions using post_to_rocket_chat().
+  1. Selects today’s two dish images with get_dishes_today(). These are
+     cropped and uploaded once a week by publish_speiseplan.py using
+     extract_dishes_week().
+  2. If they are missing, locates the weekly speiseplan image using
+     get_this_week_speiseplan(), crops today’s two dish images with
+     extract_dishes_today() and uploads them to GitHub via upload_to_github().
+  3. Posts the dish images to Rocket.Chat and adds emoji reactions using post_to_rocket_chat().
+  4. Records to which targets the dishes were posted with record_posted_dishes(),
+     so that a rerun after a failure only posts to the remaining targets.
 
 This script is to be run every weekday (Monday–Friday), for example via a cronjob
 at 1pm.
 
 Ensure that your environment variables or an env.py file provide:
   ROCKETCHAT_URL, ROCKETCHAT_ID, ROCKETCHAT_TOKEN
+or FEEDBACK_TARGETS to post to several channels and servers (see fanout.py).
 """
 import os
 import re
 import time
 import glob
 import locale
+import json
 import subprocess
 from datetime import datetime
 from PIL import Image
-from rocketchat_API.rocketchat import RocketChat
+from resilience import call, timeout_for, remaining_budget, latency_report
+from fanout import load_targets, fan_out, succeeded, raise_for_failures
+from variants import variant_path, variant_url
 
 # Load configuration either from env.py or environment variables
 try:
@@ -38,6 +47,12 @@ except ImportError:
 
 tage = ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'FEHLER', 'FEHLER']
 
+# OCR'd text of the dishes, written by the weekly publish
+DISH_TEXTS_JSON = './dishes/dish_texts.json'
+
+# names of the targets the dishes of each day were posted to
+POSTED_JSON = './dishes/posted.json'
+
 
 def get_this_week_speiseplan():
     """
@@ -74,19 +89,54 @@ def date_from_weekday(target_weekday):
     target_date = today + timedelta(days=delta_days)
     return target_date.date()
 
-# Example: Get the date of this week's Friday (5)
-
-def extract_dishes_today(speiseplan_png, weekday=None):
+def crop_dishes(image, weekday, scale=1):
     """
-    Crop out today's two dish images from the weekly speiseplan.
+    Crop the two dish images of one weekday from the weekly speiseplan.
 
     Assumptions:
       - The speiseplan image is organized into five horizontal rows (Monday-Friday).
       - Each row is split into two halves for the two dish options.
 
+    The positions are given for the speiseplan rendered at 72 dpi. For other
+    resolutions, `scale` is the factor by which the image is larger.
+
+    Returns:
+        A tuple (dish1, dish2) of PIL images.
+    """
+    padding_top = 265
+    padding_left = 118
+    padding = 9
+
+    box_height = 90
+    box_width = 210
+
+    # Crop dish1 (left half) and dish2 (right half)
+    top = padding_top + weekday*(box_height+padding)
+    bottom = top+box_height
+
+    left1 = padding_left
+    right1 = left1+box_width
+    left2 = right1+padding
+    right2 = left2+box_width
+
+    box1 = [round(x*scale) for x in (left1, top, right1, bottom)]
+    box2 = [round(x*scale) for x in (left2, top, right2, bottom)]
+    return image.crop(box1), image.crop(box2)
+
+
+def dish_paths_for(day):
+    """Return the filenames (dish1_path, dish2_path) of the dishes of `day`."""
+    day_str = day.strftime("%Y-%m-%d")
+    return f"./dishes/{day_str}_dish1.png", f"./dishes/{day_str}_dish2.png"
+
+
+def extract_dishes_today(speiseplan_png, weekday=None):
+    """
+    Crop out today's two dish images from the weekly speiseplan.
+
     Returns:
        A tuple (dish1_path, dish2_path) with the filenames of the two cropped images.
-       If today is Saturday or Sunday, returns (None, None).
+       If today is Saturday or Sunday, the script exits.
     """
     if weekday is None:
         day = datetime.now()
@@ -100,140 +150,282 @@ def extract_dishes_today(speiseplan_png, weekday=None):
         exit()
 
     image = Image.open(speiseplan_png)
-    width, height = image.size
+    dish1, dish2 = crop_dishes(image, weekday)
 
-    padding_top = 265
-    padding_left = 118
-    padding = 9
+    dish1_path, dish2_path = dish_paths_for(day)
+    os.makedirs("dishes", exist_ok=True)
+    dish1.save(dish1_path)
+    dish2.save(dish2_path)
 
-    box_height = 90
-    box_width = 210
+    print(f"Extracted dishes: {dish1_path}, {dish2_path}")
+    return dish1_path, dish2_path
 
 
-    # Assume five equal horizontal rows in the image
-    row_height = height // 5
-    top = weekday * row_height
-    bottom = (weekday + 1) * row_height
+def extract_dishes_week(speiseplan_png):
+    """
+    Crop the dishes of all five weekdays, decoding the weekly speiseplan once.
 
-    # Crop dish1 (left half) and dish2 (right half)
-    top = padding_top + weekday*(box_height+padding)
-    bottom = top+box_height
+    This is run by the weekly publish, so that the daily job only has to
+    pick today's dishes with get_dishes_today(). If the speiseplan has a
+    high resolution 'full' variant, the dishes are also cropped from it and
+    stored as 'full' variants of the dish images.
 
-    left1 = padding_left
-    right1 = left1+box_width
-    dish1 = image.crop((left1, top, right1, bottom))
+    Returns:
+        A list with one tuple (dish1_path, dish2_path) per weekday.
+    """
+    image = Image.open(speiseplan_png)
+    image.load()
+
+    full = None
+    full_png = variant_path(speiseplan_png, 'full')
+    if os.path.exists(full_png):
+        full = Image.open(full_png)
+        full.load()
+        os.makedirs(os.path.join("dishes", "variants"), exist_ok=True)
+
+    os.makedirs("dishes", exist_ok=True)
+    dish_paths = []
+    for weekday in range(5):
+        dish1_path, dish2_path = dish_paths_for(date_from_weekday(weekday))
+        dish1, dish2 = crop_dishes(image, weekday)
+        dish1.save(dish1_path)
+        dish2.save(dish2_path)
+        if full is not None:
+            full1, full2 = crop_dishes(full, weekday, scale=full.width / image.width)
+            full1.save(variant_path(dish1_path, 'full'))
+            full2.save(variant_path(dish2_path, 'full'))
+        dish_paths.append((dish1_path, dish2_path))
+
+    print(f"Extracted dishes of the week: {dish_paths}")
+    return dish_paths
+
+
+def get_dishes_today():
+    """
+    Select today's two dish images prepared by the weekly publish.
 
-    left2 = right1+padding
-    right2 = left2+box_width
-    dish2 = image.crop((left2, top, right2, bottom))
+    Returns:
+        A tuple (dish1_path, dish2_path) or None if they have not been prepared.
+        If today is Saturday or Sunday, the script exits.
+    """
+    day = datetime.now()
+    if day.weekday() >= 5:
+        print("Today is weekend. No dishes to post.")
+        exit()
 
-    today_str = day.strftime("%Y-%m-%d")
-    dish1_path = f"./dishes/{today_str}_dish1.png"
-    dish2_path = f"./dishes/{today_str}_dish2.png"
+    dish_paths = dish_paths_for(day)
+    if not all(os.path.exists(path) for path in dish_paths):
+        return None
+    print(f"Found prepared dishes: {dish_paths}")
+    return dish_paths
 
-    dish1.save(dish1_path)
-    dish2.save(dish2_path)
 
-    print(f"Extracted dishes: {dish1_path}, {dish2_path}")
-    return dish1_path, dish2_path
+def load_dish_texts(dish_paths):
+    """
+    Return the OCR'd text of the given dishes, or None for dishes without text.
+    """
+    if not os.path.exists(DISH_TEXTS_JSON):
+        return [None for _ in dish_paths]
+    with open(DISH_TEXTS_JSON, 'r', encoding='utf-8') as f:
+        texts = json.load(f)
+    return [texts.get(os.path.basename(path)) for path in dish_paths]
+
+
+def save_dish_texts(texts):
+    """
+    Add the OCR'd text of dishes to DISH_TEXTS_JSON.
+
+    Parameters:
+        texts (dict): maps the filename of a dish image to its text.
+    """
+    all_texts = {}
+    if os.path.exists(DISH_TEXTS_JSON):
+        with open(DISH_TEXTS_JSON, 'r', encoding='utf-8') as f:
+            all_texts = json.load(f)
+    all_texts.update(texts)
+    with open(DISH_TEXTS_JSON, 'w', encoding='utf-8') as f:
+        json.dump(all_texts, f, indent=1, sort_keys=True, ensure_ascii=False)
+
+
+def dish_urls(dish_paths):
+    """Return the GitHub URLs under which the dish images are served."""
+    base_url = 'https://raw.githubusercontent.com/skjerns/Speiseplan-To-Rocket-Chat/main/dishes'
+    return [f'{base_url}/{os.path.basename(file)}' for file in dish_paths]
+
+
+def push_to_github(paths, message):
+    """
+    Add, commit and push the given files to GitHub.
+
+    This function sets up the git user (if necessary), stages the files,
+    commits them with the given message, and pushes the changes.
+    """
+    print("Configuring git user...")
+    subprocess.check_output(['git', 'config', '--global', 'user.name', 'github-actions[bot]'])
+    subprocess.check_output(['git', 'config', '--global', 'user.email', 'github-actions[bot]@users.noreply.github.com'])
+
+    print(f"Adding {paths} to git...")
+    subprocess.check_output(['git', 'add', *paths])
+
+    print("Committing changes...")
+    # If there is nothing to commit, ignore the error.
+    try:
+        subprocess.check_output(['git', 'commit', '-m', message])
+    except subprocess.CalledProcessError as e:
+        msg = e.output.decode() if e.output else str(e)
+        if "nothing to commit" in msg:
+            print("No changes to commit.")
+        else:
+            print("Commit error:", msg)
+
+    print("Pushing changes to GitHub...")
+    # a failed push exits non-zero, network errors included
+    call('github', subprocess.run, ['git', 'push'], check=True,
+         timeout=timeout_for('github'), retries=2,
+         retry_on=(subprocess.CalledProcessError,))
+
 
 def upload_to_github(dish1_path, dish2_path):
     """
     Upload the dish images to GitHub by adding, committing, and pushing the new files.
-
-    This function sets up the git user (if necessary), stages the two dish images,
-    commits them with an appropriate message, and pushes the changes.
     """
     try:
-        print("Configuring git user...")
-        subprocess.check_output(['git', 'config', '--global', 'user.name', 'github-actions[bot]'])
-        subprocess.check_output(['git', 'config', '--global', 'user.email', 'github-actions[bot]@users.noreply.github.com'])
-
-        print("Adding dish images to git...")
-        subprocess.check_output(['git', 'add', dish1_path, dish2_path])
-
-        print("Committing changes...")
-        # If there is nothing to commit, ignore the error.
-        try:
-            subprocess.check_output(['git', 'commit', '-m', "Add today's dishes"])
-        except subprocess.CalledProcessError as e:
-            msg = e.output.decode() if e.output else str(e)
-            if "nothing to commit" in msg:
-                print("No changes to commit.")
-            else:
-                print("Commit error:", msg)
-
-        print("Pushing changes to GitHub...")
-        subprocess.run(['git', 'push'], check=True)
+        push_to_github([dish1_path, dish2_path], "Add today's dishes")
         print("Uploaded dishes to GitHub successfully.")
     except Exception as e:
         print("Error uploading to GitHub:", e)
 
 
-    base_url = 'https://raw.githubusercontent.com/skjerns/Speiseplan-To-Rocket-Chat/main/dishes'
-    urls = [f'{base_url}/{os.path.basename(file)}' for file in [dish1_path, dish2_path]]
-    return  urls
+    return dish_urls([dish1_path, dish2_path])
 
-def post_to_rocket_chat(urls):
+def load_posted_dishes(day):
     """
-    Post the dish images to Rocket.Chat and add emoji reactions to each post.
+    Return the names of the targets the dishes of `day` were already posted to.
+    """
+    if not os.path.exists(POSTED_JSON):
+        return []
+    with open(POSTED_JSON, 'r') as f:
+        return json.load(f).get(day.strftime('%Y-%m-%d'), [])
+
 
-    Each dish is uploaded as a file to the configured Rocket.Chat channel.
-    After posting, several reactions (e.g., :thumbsup:, :thumbsdown:, :yum:) are added.
+def record_posted_dishes(day, posted_to):
     """
-    assert isinstance(urls, list)
+    Remember the targets the dishes of `day` were posted to and push this to GitHub.
+    """
+    posted = {}
+    if os.path.exists(POSTED_JSON):
+        with open(POSTED_JSON, 'r') as f:
+            posted = json.load(f)
+    posted[day.strftime('%Y-%m-%d')] = sorted(posted_to)
+    with open(POSTED_JSON, 'w') as f:
+        json.dump(posted, f, indent=1, sort_keys=True)
+    push_to_github([POSTED_JSON], "Record posted dishes")
 
-    rocket = RocketChat(user_id=ROCKETCHAT_ID,
-                        auth_token=ROCKETCHAT_TOKEN,
-                        server_url=f'https://{ROCKETCHAT_URL}')
 
+def get_feedback_targets():
+    """
+    Where the daily dishes are posted to, see fanout.py on how to configure
+    FEEDBACK_TARGETS. Defaults to the Cafeteria-feedback channel.
+    """
+    default = [{'name': 'rocketchat', 'type': 'rocketchat',
+                'server': ROCKETCHAT_URL, 'user_id': ROCKETCHAT_ID,
+                'token': ROCKETCHAT_TOKEN, 'channel': 'Cafeteria-feedback'}]
+    return load_targets('FEEDBACK_TARGETS', default)
 
+
+def post_to_rocket_chat(urls, texts=None, targets=None):
+    """
+    Post the dish images to all feedback targets and add emoji reactions to each post.
+
+    The messages are posted to all targets in parallel, each target has its own
+    rate limit. On Rocket.Chat, several reactions (e.g., :thumbsup:, :thumbsdown:, :yum:)
+    are added after posting. If texts are given, the OCR'd text of each dish is added
+    to its message.
+
+    Returns:
+        The report of fan_out with success and latency per target. Failed
+        targets are not raised, see raise_for_failures in fanout.py.
+    """
+    assert isinstance(urls, list)
+    if texts is None:
+        texts = [None for _ in urls]
+    if targets is None:
+        targets = get_feedback_targets()
+
+    msgs = []
     for i, url in enumerate(urls):
         date_str = os.path.basename(url).split('_')[0]
         parsed_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         german_weekday = tage[parsed_date.weekday()]
 
         names = ['Meat/Fish', 'Veggy']
-        msg = (f'**{german_weekday} {i+1}**\t- {names[i]} - {parsed_date.strftime("%d. %b")}. '
-              f'\nUse the emojis to rate the food.\n\n{url}')
-
-        time.sleep(1)
-        res = rocket.chat_post_message(msg,
-                                       emoji=[':cut_of_meat:', ':leafy_green:'][i],
-                                       channel='Cafeteria-feedback',
-                                       # alias='SpeiseplanBot',
-                                       # previewUrls=[url]
-                                       )
-
-        resp_json = res.json()
-        if not resp_json.get("success"):
-            print(f"Failed to upload {url}: {resp_json}")
-            continue
-
-        message_id = resp_json.get("message", {}).get("_id")
-        print(f"Successfully posted {url} with message id: {message_id}")
-
-        # Add reactions to help users rate the dish
-        emojis = ['frowning2', 'neutral_face', 'slightly_smiling_face', 'smile', 'star_struck']
-        i = 0
-        while i<len(emojis):
-            time.sleep(0.5)
-            emoji = emojis[i]
-            res = rocket.chat_react(message_id, emoji=emoji)
-            res_json = res.json()
-            if 'error' in (err:=res_json) and 'error-too-many-requests' in err:
-                wait = int(re.search(r'\b\d+\b(?=\s+seconds)', err).group())
-                time.sleep(wait)
-                print(f'too many reqeusts, wait {wait}')
+        msg = f'**{german_weekday} {i+1}**\t- {names[i]} - {parsed_date.strftime("%d. %b")}. '
+        if texts[i]:
+            msg += f'\n_{texts[i]}_'
+        msg += f'\nUse the emojis to rate the food.\n\n{url}'
+        msgs.append(msg)
+
+    def post_dishes(target):
+        # if one dish fails, still post the other one and fail afterwards
+        errors = []
+        for i, (url, msg) in enumerate(zip(urls, msgs)):
+            try:
+                message_id = target.post(msg, emoji=[':cut_of_meat:', ':leafy_green:'][i])
+            except Exception as e:
+                print(f"{target.name}: failed to upload {url}: {e}")
+                errors.append(e)
+                continue
+            if not target.can_react:
                 continue
-            elif  'error'  in err:
-                raise Exception(f'could not react: {err}')
-            i += 1
-            print(f"Added reaction {emoji} to message {message_id}: {res.json()}")
+
+            print(f"{target.name}: successfully posted {url} with message id: {message_id}")
+
+            # Add reactions to help users rate the dish
+            emojis = ['frowning2', 'neutral_face', 'slightly_smiling_face', 'smile', 'star_struck']
+            i = 0
+            while i<len(emojis):
+                emoji = emojis[i]
+                res_json = target.react(message_id, emoji=emoji)
+                if 'error' in (err:=res_json) and 'error-too-many-requests' in str(err['error']):
+                    wait = int(re.search(r'\b\d+\b(?=\s+seconds)', str(err['error'])).group())
+                    # never wait beyond the run-time budget, the next call
+                    # then fails with BudgetExceededError
+                    wait = min(wait, max(0, remaining_budget()))
+                    print(f'too many reqeusts, wait {wait}')
+                    time.sleep(wait)
+                    continue
+                elif  'error'  in err:
+                    raise Exception(f'could not react: {err}')
+                i += 1
+                print(f"{target.name}: added reaction {emoji} to message {message_id}: {res_json}")
+        if errors:
+            raise RuntimeError(f'{len(errors)} dishes could not be posted: {errors}')
+
+    return fan_out(targets, post_dishes)
 
 if __name__ == "__main__":
 
-    speiseplan_png = get_this_week_speiseplan()
-    dish1_path, dish2_path = extract_dishes_today(speiseplan_png)
-    urls = upload_to_github(dish1_path, dish2_path)
-    post_to_rocket_chat(urls)
+    dish_paths = get_dishes_today()
+    if dish_paths is not None:
+        # already cropped and uploaded by the weekly publish
+        urls = dish_urls(dish_paths)
+    else:
+        print("Dishes were not prepared by the weekly publish, extracting them now.")
+        speiseplan_png = get_this_week_speiseplan()
+        dish_paths = extract_dishes_today(speiseplan_png)
+        urls = upload_to_github(*dish_paths)
+    # post the high resolution crops where the weekly publish made them
+    urls = [variant_url(url, path, 'full') for url, path in zip(urls, dish_paths)]
+
+    # after a partly failed run, only post to the targets that are missing
+    day = datetime.now()
+    posted_to = load_posted_dishes(day)
+    targets = [target for target in get_feedback_targets() if target.name not in posted_to]
+    if not targets:
+        print(f"Dishes were already posted to {posted_to}.")
+        exit()
+    report = post_to_rocket_chat(urls, texts=load_dish_texts(dish_paths), targets=targets)
+    if succeeded(report):
+        record_posted_dishes(day, posted_to + succeeded(report))
+    print(f'latencies per service: {latency_report()}')
+    raise_for_failures(report)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Publish the same messages to several channels, servers and telegram.
+
+The publish targets are configured as a list of dicts, either in env.py or
+as JSON in an environment variable of the same name, e.g.
+
+    SPEISEPLAN_TARGETS = [
+        {'name': 'institute', 'type': 'rocketchat', 'server': 'chat.example.org',
+         'user_id': '...', 'token': '...', 'channel': 'Speiseplan'},
+        {'name': 'mirror', 'type': 'rocketchat', 'server': 'chat.example.org',
+         'user_id': '...', 'token': '...', 'channel': 'Speiseplan-Mirror',
+         'min_interval': 2},
+        {'name': 'telegram', 'type': 'telegram',
+         'config': '~/.config/telegram-send-speiseplan.conf'},
+    ]
+
+Images are uploaded once before, only the messages linking to them are
+posted to all targets in parallel by fan_out(). The callers record which
+targets succeeded, so that a rerun only posts to the ones that failed.
+
+@author: Simon Kern
+"""
+import os
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from rocketchat_API.rocketchat import RocketChat
+from resilience import call, timeout_for
+
+
+class RateLimiter:
+    """Makes sure that calls are at least `min_interval` seconds apart."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            wait = self.last + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.last = time.monotonic()
+
+
+class Target:
+    """A Rocket.Chat channel or a telegram chat that we publish to.
+
+    Each target has its own rate limiter, circuit breaker and latency
+    record, so that one slow or broken target does not affect the others.
+    """
+
+    def __init__(self, name, type='rocketchat', server=None, user_id=None,
+                 token=None, channel=None, config=None, min_interval=0.5):
+        assert type in ('rocketchat', 'telegram'), f'unknown target type {type}'
+        self.name = name
+        self.type = type
+        self.server = server
+        self.user_id = user_id
+        self.token = token
+        self.channel = channel
+        self.config = os.path.expanduser(config) if config else None
+        self.service = f'{type}:{name}'
+        self.limiter = RateLimiter(min_interval)
+        self.rocket = None
+
+        if type == 'rocketchat':
+            assert server, f'server missing for target {name}'
+            assert user_id and token, f'ID or TOKEN missing for target {name}'
+            assert channel, f'channel missing for target {name}'
+        else:
+            assert self.config, f'telegram-send config missing for target {name}'
+
+    def __repr__(self):
+        return f'Target({self.name}, {self.type}, {self.channel or self.config})'
+
+    @property
+    def can_react(self):
+        return self.type == 'rocketchat'
+
+    def get_rocket(self):
+        if self.rocket is None:
+            self.rocket = RocketChat(user_id=self.user_id,
+                                     auth_token=self.token,
+                                     server_url=f'https://{self.server}',
+                                     timeout=timeout_for('rocketchat'))
+        return self.rocket
+
+    def post(self, msg, emoji=None):
+        """Post `msg` to this target. Posting is never retried.
+
+        Raises a RuntimeError if Rocket.Chat rejects the message.
+
+        Returns:
+            the message id for Rocket.Chat, None for telegram
+        """
+        self.limiter.wait()
+        if self.type == 'telegram':
+            call(self.service, subprocess.run,
+                 ['telegram-send', '--config', self.config, msg],
+                 check=True, capture_output=True,
+                 timeout=timeout_for('telegram'))
+            print(f'{self.name}: posted to telegram')
+            return None
+
+        kwargs = {'emoji': emoji} if emoji else {}
+        res = call(self.service, self.get_rocket().chat_post_message, msg,
+                   channel=self.channel, **kwargs)
+        resp_json = res.json()
+        print(f'{self.name}: posting to rocket.chat: {res}\n\n{resp_json}')
+        if not resp_json.get('success'):
+            raise RuntimeError(f'{self.name}: posting to {self.channel} failed: {resp_json}')
+        return resp_json.get('message', {}).get('_id')
+
+    def react(self, message_id, emoji):
+        """Add the reaction `emoji` to a message, returns the response json."""
+        self.limiter.wait()
+        res = call(self.service, self.get_rocket().chat_react, message_id, emoji=emoji)
+        return res.json()
+
+
+def load_targets(name, default):
+    """Load the publish targets called `name` from env.py or the environment.
+
+    Parameters:
+        name (str): e.g. 'SPEISEPLAN_TARGETS'
+        default (list): target dicts to use if nothing is configured
+
+    Returns:
+        a list of Target
+    """
+    try:
+        import env
+        targets = getattr(env, name)
+    except (ImportError, AttributeError):
+        targets = os.environ.get(name)
+        targets = json.loads(targets) if targets else default
+    return [Target(**target) for target in targets]
+
+
+def fan_out(targets, func):
+    """Run func(target) for all targets in parallel.
+
+    All targets are run to completion, even if some of them fail. Success
+    and latency of each target are printed. Failures are not raised, use
+    raise_for_failures on the report, after recording which targets succeeded.
+
+    Returns:
+        a list with one dict {'target', 'ok', 'seconds', 'result'} per target
+    """
+    def run(target):
+        start = time.monotonic()
+        try:
+            result = func(target)
+            ok = True
+        except Exception as e:
+            result = e
+            ok = False
+        return {'target': target.name, 'ok': ok,
+                'seconds': round(time.monotonic() - start, 3), 'result': result}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+        report = list(executor.map(run, targets))
+
+    for entry in report:
+        status = 'OK' if entry['ok'] else f'FAILED ({entry["result"]!r})'
+        print(f'fan_out: {entry["target"]} {status} in {entry["seconds"]}s')
+    return report
+
+
+def succeeded(report):
+    """Return the names of the targets that succeeded in a fan_out report."""
+    return [entry['target'] for entry in report if entry['ok']]
+
+
+def raise_for_failures(report):
+    """Raise a RuntimeError if any target of a fan_out report failed."""
+    failed = [entry for entry in report if not entry['ok']]
+    if failed:
+        raise RuntimeError(f'publishing failed for {len(failed)}/{len(report)} targets: '
+                           + ', '.join(f'{e["target"]}: {e["result"]!r}' for e in failed))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Extract the links to PDFs from the cafeteria page of the intranet.
+
+Only anchor tags and the <base> tag are looked at, all other tags and the
+text are skipped without building a tree.
+
+The page is requested conditionally and the links of the last run are
+reused if it did not change, see conditional_headers and
+links_from_response.
+
+@author: Simon Kern
+"""
+import hashlib
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+
+class PDFLinkParser(HTMLParser):
+    """Collects the hrefs of all anchor tags that link to a PDF, and the
+    href of the first <base> tag, if any."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+        self.base = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value and value.endswith('pdf'):
+                    self.hrefs.append(value)
+        elif tag == 'base' and self.base is None:
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.base = value.strip()
+
+    handle_startendtag = handle_starttag
+
+
+def extract_pdf_links(page, host):
+    """Extract all links to PDFs from the HTML `page` of the server `host`.
+
+    Links are resolved against the <base href> of the page if there is
+    one, otherwise against the root of `host`, so that a bare relative
+    link like 'fileadmin/x.pdf' means https://host/fileadmin/x.pdf.
+
+    Returns:
+        the links, without duplicates and in the order of the page. Links
+        to `host` are given as paths relative to its root, links to other
+        servers as absolute URLs.
+    """
+    parser = PDFLinkParser()
+    parser.feed(page)
+    parser.close()
+
+    root = f'https://{host}/'
+    base_url = urljoin(root, parser.base) if parser.base else root
+
+    pdfs = []
+    for href in parser.hrefs:
+        url = urlsplit(urljoin(base_url, href.strip()))
+        if url.netloc == host:
+            pdfs.append(url.path.lstrip('/') + (f'?{url.query}' if url.query else ''))
+        else:
+            pdfs.append(url.geturl())
+    return list(dict.fromkeys(pdfs))
+
+
+def conditional_headers(links_cache, page_url):
+    """Return the headers that make the request of `page_url` conditional,
+    if `links_cache` holds the links of that page."""
+    headers = {}
+    if links_cache.get('url') == page_url:
+        if links_cache.get('etag'):
+            headers['if-none-match'] = links_cache['etag']
+        if links_cache.get('last-modified'):
+            headers['if-modified-since'] = links_cache['last-modified']
+    return headers
+
+
+def links_from_response(links_cache, page_url, status_code, content, headers, host):
+    """Return the PDF links of the page `page_url`, reusing `links_cache`
+    if the server answered 304 Not Modified or the page has not changed.
+
+    Parameters:
+        links_cache (dict): as returned before, {} if there is none
+        status_code, content, headers: of the response to the request
+        host (str): the server of the page, see extract_pdf_links
+
+    Returns:
+        (pdfs, links_cache) where links_cache is the updated cache to save,
+        or None if it is still valid
+    """
+    if links_cache.get('url') != page_url:
+        links_cache = {}
+
+    if status_code == 304 and links_cache:
+        print('cafeteria page not modified, using previous PDF links')
+        return links_cache['pdfs'], None
+
+    page_hash = hashlib.sha256(content).hexdigest()
+    if links_cache.get('sha256') == page_hash:
+        print('cafeteria page unchanged, using previous PDF links')
+        pdfs = links_cache['pdfs']
+    else:
+        pdfs = extract_pdf_links(content.decode(), host)
+    return pdfs, {'url': page_url, 'sha256': page_hash, 'pdfs': pdfs,
+                  'etag': headers.get('etag'),
+                  'last-modified': headers.get('last-modified')}
@@ -9,7 +9,6 @@ Publish the Speiseplan of our cafeteria to RocketChat
 import os
 import re
 import requests
-import bs4
 from io import BytesIO
 import numpy as np
 import datetime
@@ -20,26 +19,47 @@ import subprocess
 import traceback
 import logging
 import html
+import json
+import hashlib
+import tempfile
+import importlib.metadata
 from functools import wraps
 from pprint import pprint
-from rocketchat_API.rocketchat import RocketChat
 from functools import cache
+from urllib.parse import urlsplit
 from PIL import Image
 from subprocess import check_output, STDOUT, CalledProcessError
 import google.generativeai as genai
 from datetime import timedelta
 from rapidocr_onnxruntime import RapidOCR
+from daily_feedback import extract_dishes_week, save_dish_texts, DISH_TEXTS_JSON
+from resilience import call, raising, timeout_for, remaining_budget, latency_report
+from resilience import SERVICE_TIMEOUTS
+from fanout import load_targets, fan_out, succeeded, raise_for_failures
+from variants import make_variants, variant_path, variant_url, FULL_DPI
+from links import conditional_headers, links_from_response
 
 TELEGRAM_CONF = os.path.expanduser('~/.config/telegram-send.conf')
 
+# on GitHub Actions, this directory must be kept with actions/cache between
+# runs, otherwise the caches are empty on every run, see README.md
+CACHE_DIR = os.path.expanduser(os.environ.get('SPEISEPLAN_CACHE_DIR',
+                                              '~/.cache/speiseplan'))
+
 
 def telegram_send(message):
     """Send a message via telegram-send."""
-    result = subprocess.run(
-        ['telegram-send', '--format', 'html',
-         '--config', TELEGRAM_CONF, message],
-        capture_output=True, text=True
-    )
+    # not limited by the run-time budget, errors must still be reported
+    # after it has been used up
+    try:
+        result = subprocess.run(
+            ['telegram-send', '--format', 'html',
+             '--config', TELEGRAM_CONF, message],
+            capture_output=True, text=True, timeout=SERVICE_TIMEOUTS['telegram']
+        )
+    except subprocess.TimeoutExpired:
+        logging.error('telegram-send timed out')
+        return
     if result.returncode != 0:
         logging.error(f'telegram-send failed: {result.stderr}')
 
@@ -75,8 +95,33 @@ except:
     GOOGLE_API_KEY = os.environ['GOOGLE_API_KEY']
 
 
+def get_speiseplan_targets():
+    """Where the speiseplan is published to, see fanout.py on how to
+    configure SPEISEPLAN_TARGETS. Defaults to the Speiseplan channel."""
+    default = [{'name': 'rocketchat', 'type': 'rocketchat',
+                'server': ROCKETCHAT_URL, 'user_id': ROCKETCHAT_ID,
+                'token': ROCKETCHAT_TOKEN, 'channel': 'Speiseplan'}]
+    return load_targets('SPEISEPLAN_TARGETS', default)
+
+
+def intra_url(uri):
+    """Return the full URL of a link as returned by extract_pdf_links."""
+    if uri.startswith(('http://', 'https://')):
+        return uri
+    return f'https://{INTRA_URL}/{uri}'
+
+
+def service_for(url):
+    """Circuit breaker key for `url`. Links to other servers get their own,
+    so that a dead foreign host does not block the intranet."""
+    host = urlsplit(url).netloc
+    return 'intranet' if host == INTRA_URL else f'intranet:{host}'
+
+
 def get_modified_age(uri):
-    res = requests.head(f"https://{INTRA_URL}/{uri}")
+    url = intra_url(uri)
+    res = call(service_for(url), raising(requests.head), url,
+               timeout=timeout_for('intranet'), retries=2)
     datestring = res.headers['last-modified']
     modified = datetime.datetime.strptime(datestring, '%a, %d %b %Y %H:%M:%S %Z')
     today = datetime.datetime.now()
@@ -107,12 +152,31 @@ def get_current_menu_pdf_gemini(pdfs):
         f"cafeteria menu for this week? Return only the exact filename: {pdfs}"
     )
 
-    response = model.generate_content(prompt)
+    response = call('gemini', model.generate_content, prompt,
+                    request_options={'timeout': timeout_for('gemini')}, retries=2)
     return response.text.strip()
 
 
 glob = {}
 
+# ETag, Last-Modified and hash of the cafeteria page with its PDF links,
+# so that the page is only parsed again if it changed
+LINKS_CACHE_JSON = os.path.join(CACHE_DIR, 'links.json')
+
+
+def load_links_cache():
+    if not os.path.exists(LINKS_CACHE_JSON):
+        return {}
+    with open(LINKS_CACHE_JSON, 'r') as f:
+        return json.load(f)
+
+
+def save_links_cache(links_cache):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(LINKS_CACHE_JSON, 'w') as f:
+        json.dump(links_cache, f, indent=1)
+
+
 @cache
 @telegram_on_error
 def get_current_speiseplan_url():
@@ -139,16 +203,23 @@ def get_current_speiseplan_url():
         }
 
 
+    # only download the page if it changed since the last run
+    page_url = f'https://{INTRA_URL}/zi/cafeteria'
+    links_cache = load_links_cache()
+    headers.update(conditional_headers(links_cache, page_url))
+
     # retrieve current speiseplan
-    speiseplan_response = requests.get(f'https://{INTRA_URL}/zi/cafeteria',
-                                       headers=headers)
-    assert speiseplan_response.ok
+    speiseplan_response = call('intranet', raising(requests.get), page_url,
+                               headers=headers, timeout=timeout_for('intranet'),
+                               retries=2)
 
     # extract link to PDF of current speiseplan
-    html = speiseplan_response.content.decode()
-    soup = bs4.BeautifulSoup(html)
-    links = soup.findAll(href=True)
-    pdfs = [link.attrs['href'] for link in links if link.attrs['href'].endswith('pdf')]
+    pdfs, links_cache = links_from_response(links_cache, page_url,
+                                            speiseplan_response.status_code,
+                                            speiseplan_response.content,
+                                            speiseplan_response.headers, INTRA_URL)
+    if links_cache is not None:
+        save_links_cache(links_cache)
 
     # filter all pdfs older than 2 weeks
     pdfs = [pdf for pdf in pdfs if get_modified_age(pdf).days<14]
@@ -183,7 +254,7 @@ def get_current_speiseplan_url():
     #         pdf_url = pdfs_cafeteria[-1]
 
     # download PDF
-    thisweek_url = f'https://{INTRA_URL}/{thisweek}'
+    thisweek_url = intra_url(thisweek)
     return thisweek_url
 
 
@@ -225,20 +296,169 @@ def extract_table_camelot(thisweek_url):
     return speiseplan
 
 
+# limits for downloading the speiseplan PDF
+PDF_MAX_BYTES = 20 * 1024 * 1024  # refuse anything larger than this
+PDF_DEADLINE = 60  # seconds for the entire download
+PDF_CHUNK_SIZE = 64 * 1024
+PDF_PREFIX_BYTES = 64 * 1024  # prefix hashed for the early duplicate check
+
+# hashes of all PDFs that have already been rendered. The file lives next
+# to the PNGs so that it is committed together with them.
+PDF_HASHES_JSON = './speiseplaene/pdf_hashes.json'
+
+
+def load_pdf_hashes():
+    """Load the hashes of all previously processed PDFs.
+
+    Returns:
+        dict mapping sha256 -> {'size', 'prefix', 'png', 'url', 'posted_to'}
+    """
+    if not os.path.exists(PDF_HASHES_JSON):
+        return {}
+    with open(PDF_HASHES_JSON, 'r') as f:
+        return json.load(f)
+
+
+def save_pdf_hash(sha256, entry):
+    """Remember that the PDF with this hash has been processed."""
+    hashes = load_pdf_hashes()
+    hashes[sha256] = entry
+    os.makedirs(os.path.dirname(PDF_HASHES_JSON), exist_ok=True)
+    with open(PDF_HASHES_JSON, 'w') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+
+
+def posted_everywhere(entry, targets):
+    """Whether the PDF of `entry` has been posted to all `targets`. Entries
+    recorded before the targets were tracked count as posted everywhere."""
+    if 'posted_to' not in entry:
+        return True
+    return all(target.name in entry['posted_to'] for target in targets)
+
+
+def download_pdf(url, fileobj, processed=None):
+    """Stream the PDF at `url` into `fileobj`, hashing it on the fly.
+
+    The download is aborted with ValueError if it exceeds PDF_MAX_BYTES
+    and with TimeoutError if it takes longer than PDF_DEADLINE seconds
+    or than the remaining run-time budget.
+
+    If the server sends a Content-Length and the size together with the
+    hash of the first PDF_PREFIX_BYTES match an entry of `processed`,
+    the download is stopped early as we have seen this PDF before.
+
+    Returns:
+        (entry, duplicate) where entry is a dict with 'sha256', 'size' and
+        'prefix' of the download and duplicate is the matching entry of
+        `processed` or None if the PDF is new. For early aborts, the
+        'sha256' of entry is the one of the matching PDF.
+    """
+    processed = processed or {}
+    deadline = time.monotonic() + min(PDF_DEADLINE, remaining_budget())
+    sha256 = hashlib.sha256()
+    prefix = hashlib.sha256()
+    size = 0
+
+    response = call(service_for(url), raising(requests.get), url, stream=True,
+                    timeout=timeout_for('intranet'), retries=2)
+    with response:
+        content_length = int(response.headers.get('content-length', 0))
+        if content_length > PDF_MAX_BYTES:
+            raise ValueError(f'{url} is too large: {content_length} bytes')
+
+        for chunk in response.iter_content(chunk_size=PDF_CHUNK_SIZE):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'download of {url} exceeded its deadline')
+            if size + len(chunk) > PDF_MAX_BYTES:
+                raise ValueError(f'{url} is larger than {PDF_MAX_BYTES} bytes')
+
+            # only the first PDF_PREFIX_BYTES go into the prefix hash
+            if size < PDF_PREFIX_BYTES:
+                prefix.update(chunk[:PDF_PREFIX_BYTES - size])
+            size += len(chunk)
+            sha256.update(chunk)
+            fileobj.write(chunk)
+
+            # as soon as the prefix is complete, check if we know this PDF
+            if content_length and size - len(chunk) < PDF_PREFIX_BYTES <= size:
+                for known_sha256, known in processed.items():
+                    if (known['size'] == content_length
+                            and known['prefix'] == prefix.hexdigest()):
+                        print(f'{url} matches already processed PDF {known_sha256}')
+                        entry = {'sha256': known_sha256, 'size': content_length,
+                                 'prefix': known['prefix']}
+                        return entry, known
+
+    # PDFs that are smaller than the prefix are hashed completely anyway
+    entry = {'sha256': sha256.hexdigest(), 'size': size, 'prefix': prefix.hexdigest()}
+    return entry, processed.get(entry['sha256'])
+
+
 @telegram_on_error
-def extract_image(thisweek_url):
-    response = requests.get(thisweek_url)
-    assert response.ok
+def extract_image(thisweek_url, force=False, targets=None):
+    """Download the speiseplan PDF and render its first page to a PNG.
+
+    The PDF is streamed into a temporary file instead of being held in
+    memory. If it has already been posted to all `targets` before (e.g.
+    the cafeteria did not upload a new plan yet), nothing is rendered and
+    None is returned, unless `force` is set.
+
+    The PDF is not recorded as processed here, call record_posted_pdf
+    with the returned entry once the speiseplan has been posted.
+
+    Returns:
+        (filename, entry) of the PNG and the hashes of the PDF, or
+        (None, None) if the PDF is a duplicate
+    """
     import fitz # pip install pymupdf
-    f = BytesIO(response.content)
-    doc = fitz.open(stream=f)
-    page = doc.load_page(0)  # number of page
-    pix = page.get_pixmap()
-    os.makedirs('speiseplaene', exist_ok=True)
-    filename = datetime.datetime.now().strftime('./speiseplaene/%Y-%m-%d.png')
-    pix.save(filename)
-    doc.close()
-    return filename
+    if targets is None:
+        targets = get_speiseplan_targets()
+    processed = {} if force else {sha256: entry for sha256, entry in load_pdf_hashes().items()
+                                  if posted_everywhere(entry, targets)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdf_file = os.path.join(tmpdir, 'speiseplan.pdf')
+        with open(pdf_file, 'wb') as f:
+            entry, duplicate = download_pdf(thisweek_url, f, processed)
+
+        if duplicate is not None:
+            print(f'PDF {thisweek_url} was already processed as {duplicate["png"]}')
+            return None, None
+
+        doc = fitz.open(pdf_file)
+        page = doc.load_page(0)  # number of page
+        os.makedirs('speiseplaene', exist_ok=True)
+        filename = datetime.datetime.now().strftime('./speiseplaene/%Y-%m-%d.png')
+
+        # rasterize once at high resolution for chat clients, see variants.py
+        full_png = variant_path(filename, 'full')
+        os.makedirs(os.path.dirname(full_png), exist_ok=True)
+        pix = page.get_pixmap(dpi=FULL_DPI)
+        pix.save(full_png)
+
+        # the image itself keeps the size of a 72 dpi rendering, which the
+        # crop and OCR positions rely on
+        size = page.rect.round()
+        full = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+        full.resize((size.width, size.height), Image.LANCZOS).save(filename)
+        doc.close()
+
+    return filename, entry
+
+
+@telegram_on_error
+def record_posted_pdf(entry, png_file, thisweek_url, posted_to):
+    """Remember to which targets the PDF has been posted and push this to GitHub.
+
+    This is only done after posting, so that a rerun after a failed post
+    posts the PDF to the targets that are missing in `posted_to`, and only
+    to those.
+    """
+    save_pdf_hash(entry['sha256'], {'size': entry['size'], 'prefix': entry['prefix'],
+                                    'png': os.path.basename(png_file),
+                                    'url': thisweek_url,
+                                    'posted_to': sorted(posted_to)})
+    push_to_github([PDF_HASHES_JSON], 'Record posted speiseplan')
 
 def crop_image(png_file):
     image = Image.open(png_file)
@@ -247,6 +467,98 @@ def crop_image(png_file):
     cropped.paste(week, box=[150, 0])
     cropped.save(png_file)
 
+# OCR results are cached on disk, keyed by the hash of the image and the
+# preprocessing parameters. Bump OCR_CACHE_VERSION whenever the way we
+# run the OCR changes, so that old entries are not used anymore.
+OCR_CACHE_DIR = os.path.join(CACHE_DIR, 'ocr')
+OCR_CACHE_MAX_BYTES = 50 * 1024 * 1024
+OCR_CACHE_VERSION = '1'
+OCR_THRESHOLD = 190
+
+
+def ocr_engine_version():
+    """Return the version of the OCR engine, part of the cache key."""
+    try:
+        return importlib.metadata.version('rapidocr_onnxruntime')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def ocr_cache_key(png_file, threshold):
+    """Hash the image content together with everything that affects the OCR."""
+    with open(png_file, 'rb') as f:
+        image_hash = hashlib.sha256(f.read()).hexdigest()
+    params = f'{OCR_CACHE_VERSION}-{ocr_engine_version()}-{threshold}'
+    return hashlib.sha256(f'{image_hash}-{params}'.encode()).hexdigest()
+
+
+def ocr_cache_get(key):
+    """Return the cached OCR lines for `key` or None if not cached."""
+    cache_file = os.path.join(OCR_CACHE_DIR, f'{key}.json')
+    try:
+        with open(cache_file, 'r') as f:
+            lines = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # touch the file, the modification time is used for LRU eviction
+    os.utime(cache_file)
+    return lines
+
+
+def ocr_cache_put(key, lines):
+    """Store the OCR lines for `key` and evict the least recently used
+    entries if the cache grows larger than OCR_CACHE_MAX_BYTES."""
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(OCR_CACHE_DIR, f'{key}.json'), 'w') as f:
+        json.dump(lines, f)
+
+    entries = [e for e in os.scandir(OCR_CACHE_DIR) if e.name.endswith('.json')]
+    entries = sorted(entries, key=lambda e: e.stat().st_mtime, reverse=True)
+    total = 0
+    for entry in entries:
+        total += entry.stat().st_size
+        if total > OCR_CACHE_MAX_BYTES:
+            os.remove(entry.path)
+
+
+def binarize(image, threshold):
+    """Convert to grayscale and binarize with `threshold`.
+
+    If threshold is None, the image is only converted to grayscale.
+    """
+    gray = image.convert('L')
+    if threshold is None:
+        return gray
+    return gray.point(lambda x: 0 if x < threshold else 255)
+
+
+def ocr_images(png_files, threshold=OCR_THRESHOLD):
+    """OCR several images using a single OCR engine, using the cache.
+
+    Returns:
+        a list with one entry per image, each a list of [box, text, score]
+        lines as returned by RapidOCR
+    """
+    results = []
+    ocr = None
+    for png_file in png_files:
+        key = ocr_cache_key(png_file, threshold)
+        lines = ocr_cache_get(key)
+        if lines is None:
+            # only load the model if there is actually something to OCR
+            if ocr is None:
+                ocr = RapidOCR()
+            binary = binarize(Image.open(png_file), threshold)
+            result, _ = ocr(np.array(binary))
+            lines = [[np.asarray(box).tolist(), text, float(score)]
+                     for box, text, score in (result or [])]
+            ocr_cache_put(key, lines)
+        else:
+            print(f'ocr_images: using cached OCR for {png_file}')
+        results.append(lines)
+    return results
+
+
 @telegram_on_error
 def verify_image(png_file):
     """OCR the speiseplan image and check that the dates match the expected week.
@@ -257,14 +569,10 @@ def verify_image(png_file):
 
     Returns True if verification passes, False otherwise.
     """
-    image = Image.open(png_file)
-    # convert to grayscale and binarize: the date text is often light blue
+    # the image is binarized before OCR: the date text is often light blue
     # and hard for OCR to pick up without preprocessing
-    gray = image.convert('L')
-    binary = gray.point(lambda x: 0 if x < 190 else 255)
-    ocr = RapidOCR()
-    result, _ = ocr(np.array(binary))
-    text = ' '.join([line[1] for line in result]) if result else ''
+    lines = ocr_images([png_file], threshold=OCR_THRESHOLD)[0]
+    text = ' '.join([line[1] for line in lines])
 
     # find all dates in dd.mm.yyyy format
     dates_found = re.findall(r'\d{2}\.\d{2}\.\d{4}', text)
@@ -297,6 +605,41 @@ def verify_image(png_file):
     return True
 
 
+# the OCR'd dish text is only added to the daily posts if enabled, its
+# quality has not been checked on enough weeks yet
+DISH_OCR = os.environ.get('SPEISEPLAN_DISH_OCR', '') == '1'
+# lines recognized with a lower confidence are dropped from the dish text
+DISH_OCR_MIN_SCORE = 0.8
+
+
+@telegram_on_error
+def prepare_dishes(png_file, ocr=False):
+    """Crop the dishes of all weekdays from the speiseplan in one go.
+
+    The crops are committed together with the speiseplan by
+    upload_to_github, so that daily_feedback.py only has to post them.
+    If `ocr` is set, the text of each dish is recognized on the high
+    resolution crops and stored alongside for the daily posts. Lines
+    below DISH_OCR_MIN_SCORE are left out.
+
+    Returns:
+        a list with one tuple (dish1_path, dish2_path) per weekday
+    """
+    dish_paths = extract_dishes_week(png_file)
+    if ocr:
+        files = [file for pair in dish_paths for file in pair]
+        # the 72 dpi crops are too small to be read reliably
+        sources = [variant_path(file, 'full') for file in files]
+        sources = [source if os.path.exists(source) else file
+                   for source, file in zip(sources, files)]
+        # the dish text is dark on white, no binarization needed
+        results = ocr_images(sources, threshold=None)
+        texts = [' '.join([text for _, text, score in lines if score >= DISH_OCR_MIN_SCORE])
+                 for lines in results]
+        save_dish_texts(dict(zip([os.path.basename(f) for f in files], texts)))
+    return dish_paths
+
+
 def extract_table_tabula(thisweek_url):
     import tabula # pip install tabula-py
     response = requests.get(thisweek_url)
@@ -392,14 +735,10 @@ def clean(word):
     return word
 
 
-def post_speiseplan_ascii_to_rocket_chat(speiseplan):
+def post_speiseplan_ascii_to_rocket_chat(speiseplan, targets=None):
     import tabulate
-    assert ROCKETCHAT_URL, 'ROCKETCHAT_URL missing'
-    assert ROCKETCHAT_ID and ROCKETCHAT_TOKEN, 'ID or TOKEN missing'
-    # login to the rocket chat server
-    rocket = RocketChat(user_id=ROCKETCHAT_ID,
-                        auth_token=ROCKETCHAT_TOKEN,
-                        server_url=f'https://{ROCKETCHAT_URL}')
+    if targets is None:
+        targets = get_speiseplan_targets()
 
     now = datetime.datetime.now()
     monday = now - datetime.timedelta(days = now.weekday())
@@ -429,8 +768,7 @@ def post_speiseplan_ascii_to_rocket_chat(speiseplan):
                               tablefmt="fancy_grid", maxcolwidths=[3, 22])
     table = '\n'.join([x[:5] + x[9:] for x in table.split('\n')])
 
-    res = rocket.chat_post_message(f'```\n{table}\n```', channel='Speiseplan')
-    print(f'posting to rocket.chat: {res}\n\n{res.content.decode()}')
+    raise_for_failures(fan_out(targets, lambda target: target.post(f'```\n{table}\n```')))
     return table
 
 
@@ -439,8 +777,8 @@ def send_cmd(cmd, sock):
     response = sock.recv(4096).decode()
     return response
 
-@telegram_on_error
-def upload_to_github(png_file):
+def push_to_github(paths, message):
+    """Commit the files matching `paths` and push them to GitHub."""
     "git config --global user.name 'github-actions[bot]'".split()
     "git config --global user.email 'github-actions[bot]@users.noreply.github.com'".split()
 
@@ -455,12 +793,12 @@ def upload_to_github(png_file):
     print('\n\ngit remote', output.decode())
 
     # Add files to git
-    output = subprocess.check_output(['git', 'add', './speiseplaene/*'])
+    output = subprocess.check_output(['git', 'add', *paths])
     print('\n\ngit add', output.decode())
 
     # Commit changes
     try:
-        output = subprocess.check_output(['git', 'commit', '-m', 'Add recent speiseplan'], stderr=STDOUT)
+        output = subprocess.check_output(['git', 'commit', '-m', message], stderr=STDOUT)
     except subprocess.CalledProcessError as e:
         msg = e.output.decode()
         print(msg)
@@ -468,7 +806,25 @@ def upload_to_github(png_file):
             raise e
 
     # Push changes
-    subprocess.run(['git', 'push'], check=True)
+    # a failed push exits non-zero, network errors included
+    call('github', subprocess.run, ['git', 'push'], check=True,
+         timeout=timeout_for('github'), retries=2,
+         retry_on=(subprocess.CalledProcessError,))
+
+
+# variants of the speiseplan that are posted and therefore committed
+POSTED_VARIANTS = ['mobile', 'full']
+
+@telegram_on_error
+def upload_to_github(png_file, dish_paths=()):
+    """Commit the speiseplan, the variants that are posted and the dishes
+    of the week, and push them. The daily job posts the 'full' variant of
+    the dishes and falls back to the dish crops themselves."""
+    paths = [png_file] + [variant_path(png_file, name) for name in POSTED_VARIANTS]
+    for dish_path in [file for pair in dish_paths for file in pair]:
+        paths += [dish_path, variant_path(dish_path, 'full')]
+    paths.append(DISH_TEXTS_JSON)
+    push_to_github([path for path in paths if os.path.exists(path)], 'Add recent speiseplan')
 
     # give time to github to sort everything out
     time.sleep(1)
@@ -539,28 +895,37 @@ def upload_file_ftp_sh(local_file_path):
     return  f'https://{FTP_URL}/speiseplan/{local_file_path}'
 
 @telegram_on_error
-def post_speiseplan_image_to_rocket_chat(url, verified=True):
-    assert ROCKETCHAT_URL, 'ROCKETCHAT_URL missing'
-    assert ROCKETCHAT_ID and ROCKETCHAT_TOKEN, 'ID or TOKEN missing'
-    rocket = RocketChat(user_id=ROCKETCHAT_ID,
-                        auth_token=ROCKETCHAT_TOKEN,
-                        server_url=f'https://{ROCKETCHAT_URL}')
+def post_speiseplan_image_to_rocket_chat(url, verified=True, targets=None, full_url=None):
+    """Post the link to the uploaded speiseplan to all publish targets in parallel.
+
+    `url` is posted for the preview, usually the mobile variant. If a
+    `full_url` of the high resolution variant is given, it is linked too.
+
+    Failed targets are not raised, see check_posted.
+
+    Returns:
+        the report of fan_out with success and latency per target
+    """
+    if targets is None:
+        targets = get_speiseplan_targets()
 
     now = datetime.datetime.now()
     expected_monday = now - timedelta(days=now.weekday())
     now_str = now.strftime('%d. %b %Y')
-    msg = f'Week start: {now_str}.\n{url}'
+    if full_url and full_url != url:
+        msg = f'Week start: {now_str}.\n{url}\nFull resolution: {full_url}'
+    else:
+        msg = f'Week start: {now_str}.\n{url}'
     if not verified:
         expected_date = expected_monday.strftime('%d.%m.%Y')
         msg += (f'\n\nThere might be an error, could not find {expected_date} '
                 f'in the table. Please check manually if this is the correct Speiseplan.')
-    res = rocket.chat_post_message(msg,
-                                   channel='Speiseplan',
-                                   emoji='robot'
-                                   # alias='SpeiseplanBot',
-                                    # previewUrls=[url]
-                         )
-    print(f'posting to rocket.chat: {res}\n\n{res.content.decode()}')
+    return fan_out(targets, lambda target: target.post(msg, emoji='robot'))
+
+@telegram_on_error
+def check_posted(report):
+    """Raise, and thereby report via telegram, if posting to any target failed."""
+    raise_for_failures(report)
 
 @telegram_on_error
 def test():
@@ -570,11 +935,35 @@ def test():
 if __name__=='__main__':
     #test()
     thisweek_url = get_current_speiseplan_url()
-    png_file = extract_image(thisweek_url)
+    targets = get_speiseplan_targets()
+    png_file, pdf_entry = extract_image(thisweek_url, targets=targets)
+    if png_file is None:
+        msg = f'Speiseplan PDF {thisweek_url} has not changed since the last run, not posting.'
+        print(msg)
+        telegram_send(html.escape(msg))
+        exit()
     # crop_image(png_file)
     verified = verify_image(png_file)
-    url = upload_to_github(png_file)
+    try:
+        dish_paths = prepare_dishes(png_file, ocr=DISH_OCR)
+    except Exception:
+        # already reported via telegram, daily_feedback.py will crop the
+        # dishes itself if they are missing
+        dish_paths = []
+    make_variants(png_file)
+    url = upload_to_github(png_file, dish_paths)
+    mobile_url = variant_url(url, png_file, 'mobile')
+    full_url = variant_url(url, png_file, 'full')
     # url = upload_to_imagebb(png_file)
     # url = upload_file_ftp_sh(png_file)
     # url = upload_file_ftp(png_file)
-    post_speiseplan_image_to_rocket_chat(url, verified=verified)
+    # after a partly failed run, only post to the targets that are missing
+    posted_to = load_pdf_hashes().get(pdf_entry['sha256'], {}).get('posted_to', [])
+    pending = [target for target in targets if target.name not in posted_to]
+    report = post_speiseplan_image_to_rocket_chat(mobile_url, verified=verified,
+                                                  targets=pending, full_url=full_url)
+    posted_to = posted_to + succeeded(report)
+    if posted_to:
+        record_posted_pdf(pdf_entry, png_file, thisweek_url, posted_to)
+    check_posted(report)
+    print(f'latencies per service: {latency_report()}')
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Timeouts, retries and circuit breakers for all external calls.
+
+Every call to the intranet, Gemini, Rocket.Chat, GitHub or telegram goes
+through call(), which
+
+  - refuses to start if the service failed repeatedly (circuit breaker)
+    or if the total run-time budget RUN_BUDGET is used up,
+  - retries idempotent calls with jittered exponential backoff, but only
+    on transient errors: connection errors, timeouts, 5xx and 429,
+  - records the latency of each attempt per service.
+
+The deadline of a single attempt is passed to the underlying library by
+the caller, using timeout_for(service), so that a hung request turns into
+an exception instead of stalling the run.
+
+@author: Simon Kern
+"""
+import math
+import time
+import random
+import threading
+import subprocess
+from functools import wraps
+from collections import defaultdict
+
+import requests
+
+# seconds a single attempt may take per service
+SERVICE_TIMEOUTS = {'intranet': 20,
+                    'gemini': 60,
+                    'rocketchat': 20,
+                    'github': 120,
+                    'telegram': 30}
+
+# the whole run must finish within this many seconds
+RUN_BUDGET = 15 * 60
+RUN_START = time.monotonic()
+
+# retries with exponential backoff and full jitter
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 30
+
+# open the circuit after this many consecutive failed calls (each call
+# counts once, however many attempts it made), try again after
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+LATENCIES = defaultdict(list)
+
+
+class CircuitOpenError(Exception):
+    """Raised if a service failed too often and is not called anymore."""
+
+
+class BudgetExceededError(TimeoutError):
+    """Raised if the run-time budget of the run is used up."""
+
+
+class CircuitBreaker:
+    """Stops calling a service after BREAKER_THRESHOLD consecutive failures.
+
+    After BREAKER_COOLDOWN seconds, a single call is let through again. If
+    it succeeds, the circuit is closed, otherwise it stays open.
+    """
+
+    def __init__(self, service, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.service = service
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f'{self.service} failed {self.failures} times, '
+                                       f'not calling it for {self.cooldown}s')
+            # half-open: let this call through, a failure opens it again
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+BREAKERS = {}
+BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(service):
+    """Return the circuit breaker of `service`, shared by all threads."""
+    with BREAKERS_LOCK:
+        if service not in BREAKERS:
+            BREAKERS[service] = CircuitBreaker(service)
+        return BREAKERS[service]
+
+
+def remaining_budget():
+    """Seconds left of the run-time budget of this run."""
+    return RUN_BUDGET - (time.monotonic() - RUN_START)
+
+
+def timeout_for(service):
+    """Deadline for a single attempt, never longer than the remaining budget."""
+    remaining = remaining_budget()
+    if remaining <= 0:
+        raise BudgetExceededError(f'run-time budget of {RUN_BUDGET}s is used up')
+    return min(SERVICE_TIMEOUTS[service], remaining)
+
+
+def raising(func):
+    """Wrap a requests function so that 4xx/5xx responses raise.
+
+    requests returns error responses without raising, so call() would not
+    retry them. Use as call('intranet', raising(requests.get), url, ...).
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        response = func(*args, **kwargs)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return response
+    return wrapper
+
+
+def is_transient(e):
+    """Whether retrying might help: connection errors, timeouts, and HTTP
+    5xx or 429. Other 4xx, e.g. a 404 of a dead link, are permanent."""
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, ConnectionError,
+                      TimeoutError, subprocess.TimeoutExpired)):
+        return True
+    # requests' HTTPError carries the response, Google API errors a code
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(e, 'code', None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return False
+
+
+def call(service, func, *args, retries=0, retry_on=(), **kwargs):
+    """Call func(*args, **kwargs) guarded by the circuit breaker of `service`.
+
+    `service` can be qualified, e.g. 'rocketchat:mirror', to give a single
+    publish target its own circuit breaker and latency record.
+
+    Only set `retries` for idempotent calls, e.g. GET requests or a git push.
+    Only transient errors (see is_transient) and the exception types in
+    `retry_on` are retried, everything else is raised at once. Between
+    attempts, we wait a jittered, exponentially growing delay, as long as
+    the run-time budget allows it.
+
+    A call that finally fails with a transient error counts as one failure
+    for the circuit breaker. Permanent errors do not count, the service
+    did answer after all.
+
+    Returns:
+        whatever func returns
+    """
+    breaker = get_breaker(service)
+    for attempt in range(retries + 1):
+        breaker.check()
+        if remaining_budget() <= 0:
+            raise BudgetExceededError(f'run-time budget of {RUN_BUDGET}s is used up')
+
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            LATENCIES[service].append(time.monotonic() - start)
+            if not (is_transient(e) or isinstance(e, retry_on)):
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+            if attempt == retries or delay >= remaining_budget():
+                breaker.failure()
+                raise
+            print(f'{service}: attempt {attempt+1} failed ({type(e).__name__}: {e}), '
+                  f'retrying in {delay:.1f}s')
+            time.sleep(delay)
+            continue
+        LATENCIES[service].append(time.monotonic() - start)
+        breaker.success()
+        return result
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values`, q between 0 and 100."""
+    values = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[index]
+
+
+def latency_report():
+    """Summarize the latencies of all calls per service, in seconds.
+
+    Returns:
+        dict mapping service -> {'n', 'p50', 'p95', 'max'}
+    """
+    report = {}
+    for service, latencies in LATENCIES.items():
+        report[service] = {'n': len(latencies),
+                           'p50': round(percentile(latencies, 50), 3),
+                           'p95': round(percentile(latencies, 95), 3),
+                           'max': round(max(latencies), 3)}
+    return report
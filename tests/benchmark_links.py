@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark links.extract_pdf_links against the previous BeautifulSoup
+extraction.
+
+Usage:
+    python tests/benchmark_links.py [saved_page.html ...]
+
+Without arguments, synthetic pages of increasing size are used. Saved
+intranet pages can be passed to benchmark on real data.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from links import extract_pdf_links  # noqa: E402
+from pages import HOST, make_page  # noqa: E402
+from test_links import extract_pdf_urls_bs4  # noqa: E402
+
+
+def benchmark(name, page, number=5):
+    t_bs4 = min(timeit.repeat(lambda: extract_pdf_urls_bs4(page, HOST), number=1, repeat=number))
+    t_new = min(timeit.repeat(lambda: extract_pdf_links(page, HOST), number=1, repeat=number))
+    print(f'{name:>24} {len(page)/1024:>9.0f} KiB  bs4 {t_bs4*1000:>8.1f} ms  '
+          f'links.py {t_new*1000:>8.1f} ms  speedup {t_bs4/t_new:>5.1f}x')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for file in sys.argv[1:]:
+            with open(file, 'r', encoding='utf-8', errors='replace') as f:
+                benchmark(os.path.basename(file), f.read())
+    else:
+        for n_blocks in [10, 100, 1000, 5000]:
+            benchmark(f'synthetic {n_blocks} blocks', make_page(n_blocks))
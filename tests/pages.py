@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic intranet pages for the tests and the benchmark of links.py.
+"""
+HOST = 'intra.example.org'
+
+BLOCK = '''
+<div class="news">
+  <h2>Neuigkeiten {i}</h2>
+  <img src="/fileadmin/img/{i}.png" alt="Bild {i}">
+  <p>Text &amp; mehr Text <a href="/zi/seite-{i}">Seite {i}</a>
+     <a href="fileadmin/user_upload/Speiseplan_{i}.pdf">Speiseplan {i}</a>
+     <a href="/fileadmin/Preisliste.pdf">Preisliste</a>
+     <a class="ext" href="fileadmin/Aushang%20{i}.pdf">Aushang</a>
+     <a href="mailto:cafeteria@example.org">Mail</a>
+     <A HREF="fileadmin/LMIV_{i}.pdf?v=1&amp;t=pdf">LMIV</A>
+  </p>
+  <script>var x = "<a href='nope.pdf'>";</script>
+</div>
+'''
+
+
+def make_page(n_blocks):
+    """Return an intranet-like page with `n_blocks` news blocks, each with
+    relative, root-relative, duplicated and entity-escaped PDF links."""
+    body = ''.join(BLOCK.format(i=i) for i in range(n_blocks))
+    return ('<!DOCTYPE html><html><head><title>Cafeteria</title>'
+            '<link rel="stylesheet" href="/style.css"></head>'
+            f'<body><nav><a href="/">Start</a></nav>{body}</body></html>')
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Compare links.extract_pdf_links with the BeautifulSoup based extraction
+that get_current_speiseplan_url used before, and test the reuse of the
+links of the last run.
+"""
+import os
+import sys
+import hashlib
+import warnings
+
+import bs4
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from links import extract_pdf_links, conditional_headers, links_from_response  # noqa: E402
+from pages import HOST, make_page  # noqa: E402
+
+
+def extract_pdf_urls_bs4(page, host):
+    """The previous extraction, unchanged, returning the URLs that were
+    downloaded. It used the default parser and the deprecated findAll."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        soup = bs4.BeautifulSoup(page)
+        links = soup.findAll(href=True)
+    pdfs = [link.attrs['href'] for link in links if link.attrs['href'].endswith('pdf')]
+    return [f'https://{host}/{pdf}' for pdf in pdfs]
+
+
+def extract_pdf_urls(page, host):
+    return [pdf if pdf.startswith(('http://', 'https://')) else f'https://{host}/{pdf}'
+            for pdf in extract_pdf_links(page, host)]
+
+
+@pytest.mark.parametrize('n_blocks', [0, 1, 5, 500])
+def test_same_as_bs4(n_blocks):
+    page = make_page(n_blocks)
+    urls = extract_pdf_urls_bs4(page, HOST)
+    # intended: root-relative links do not get a double slash anymore
+    urls = [url.replace(f'https://{HOST}//', f'https://{HOST}/') for url in urls]
+    # intended: each PDF is only listed once
+    urls = list(dict.fromkeys(urls))
+    assert extract_pdf_urls(page, HOST) == urls
+
+
+def test_bare_relative_links_resolve_against_root():
+    page = '<a href="fileadmin/x.pdf">x</a>'
+    assert extract_pdf_links(page, HOST) == ['fileadmin/x.pdf']
+    assert extract_pdf_urls(page, HOST) == extract_pdf_urls_bs4(page, HOST)
+
+
+def test_root_relative_links():
+    page = '<a href="/zi/y.pdf">y</a>'
+    assert extract_pdf_urls_bs4(page, HOST) == [f'https://{HOST}//zi/y.pdf']
+    assert extract_pdf_urls(page, HOST) == [f'https://{HOST}/zi/y.pdf']
+
+
+def test_duplicates():
+    page = '<a href="x.pdf">x</a><a href="x.pdf">again</a>'
+    assert extract_pdf_urls_bs4(page, HOST) == [f'https://{HOST}/x.pdf'] * 2
+    assert extract_pdf_urls(page, HOST) == [f'https://{HOST}/x.pdf']
+
+
+def test_base_href():
+    page = ('<head><base href="https://intra.example.org/zi/"></head>'
+            '<a href="fileadmin/x.pdf">x</a><a href="/y.pdf">y</a>')
+    assert extract_pdf_links(page, HOST) == ['zi/fileadmin/x.pdf', 'y.pdf']
+
+    page = '<base href="/docs/"/><a href="x.pdf">x</a>'
+    assert extract_pdf_links(page, HOST) == ['docs/x.pdf']
+
+
+def test_absolute_links():
+    page = ('<a href="https://intra.example.org/a.pdf">a</a>'
+            '<a href="https://other.example.org/b.pdf?x=1&amp;y=2&amp;f=pdf">b</a>'
+            '<a href="//cdn.example.org/c.pdf">c</a>')
+    assert extract_pdf_links(page, HOST) == ['a.pdf',
+                                             'https://other.example.org/b.pdf?x=1&y=2&f=pdf',
+                                             'https://cdn.example.org/c.pdf']
+
+
+def test_only_anchors():
+    page = ('<link href="/style.pdf"><area href="map.pdf"><a href>empty</a>'
+            '<a href="x.pdf#page=2">fragment</a><a name="top">no href</a>')
+    assert extract_pdf_urls_bs4(page, HOST) == [f'https://{HOST}//style.pdf',
+                                                f'https://{HOST}/map.pdf']
+    assert extract_pdf_links(page, HOST) == []
+
+
+PAGE_URL = f'https://{HOST}/zi/cafeteria'
+PAGE = b'<a href="new.pdf">new</a>'
+CACHE = {'url': PAGE_URL, 'sha256': hashlib.sha256(PAGE).hexdigest(),
+         'pdfs': ['old.pdf'], 'etag': '"abc"',
+         'last-modified': 'Mon, 03 Mar 2025 08:00:00 GMT'}
+
+
+def test_conditional_headers():
+    assert conditional_headers(CACHE, PAGE_URL) == {
+        'if-none-match': '"abc"', 'if-modified-since': 'Mon, 03 Mar 2025 08:00:00 GMT'}
+    assert conditional_headers({**CACHE, 'etag': None}, PAGE_URL) == {
+        'if-modified-since': 'Mon, 03 Mar 2025 08:00:00 GMT'}
+    assert conditional_headers(CACHE, f'https://{HOST}/other') == {}
+    assert conditional_headers({}, PAGE_URL) == {}
+
+
+def test_not_modified_reuses_links():
+    pdfs, cache = links_from_response(CACHE, PAGE_URL, 304, b'', {}, HOST)
+    assert pdfs == ['old.pdf']
+    assert cache is None
+
+
+def test_unchanged_page_reuses_links():
+    headers = {'etag': '"def"', 'last-modified': 'Mon, 10 Mar 2025 08:00:00 GMT'}
+    pdfs, cache = links_from_response(CACHE, PAGE_URL, 200, PAGE, headers, HOST)
+    assert pdfs == ['old.pdf']
+    assert cache == {**CACHE, 'etag': '"def"',
+                     'last-modified': 'Mon, 10 Mar 2025 08:00:00 GMT'}
+
+
+def test_changed_page_is_parsed():
+    page = b'<a href="newer.pdf">newer</a>'
+    pdfs, cache = links_from_response(CACHE, PAGE_URL, 200, page, {'etag': '"def"'}, HOST)
+    assert pdfs == ['newer.pdf']
+    assert cache == {'url': PAGE_URL, 'sha256': hashlib.sha256(page).hexdigest(),
+                     'pdfs': ['newer.pdf'], 'etag': '"def"', 'last-modified': None}
+
+
+def test_cache_of_other_page_is_ignored():
+    other = {**CACHE, 'url': f'https://{HOST}/other'}
+    pdfs, cache = links_from_response(other, PAGE_URL, 200, PAGE, {}, HOST)
+    assert pdfs == ['new.pdf']
+    assert cache['url'] == PAGE_URL
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Generate smaller variants of the speiseplan images for chat clients.
+
+For an image ./speiseplaene/2025-02-17.png, the variants are stored as
+
+    ./speiseplaene/variants/2025-02-17_full.png
+    ./speiseplaene/variants/2025-02-17_mobile.png
+    ./speiseplaene/variants/2025-02-17_thumb.png
+
+extract_image rasterizes the PDF once, at FULL_DPI, into the 'full'
+variant. Everything else is scaled down from that raster: the image
+itself to 72 dpi (596 px wide), which the crop and OCR positions rely
+on, and the variants in VARIANT_WIDTHS by make_variants. Variants are
+never upscaled: if the source is not wider than a variant, the source is
+used instead. Variants are only regenerated if the source changes.
+
+Only the variants that are posted are committed, see upload_to_github.
+The others and the manifests stay local and are ignored by git.
+
+@author: Simon Kern
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# resolution of the 'full' raster, A4 portrait is 1654 px wide at 200 dpi
+FULL_DPI = 200
+
+# name of the variant -> width in pixels, scaled down from 'full'
+VARIANT_WIDTHS = {'thumb': 320, 'mobile': 1080}
+
+
+def variant_path(png_file, name):
+    """Return the filename of the variant `name` of `png_file`."""
+    folder, filename = os.path.split(png_file)
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(folder, 'variants', f'{stem}_{name}{ext}')
+
+
+def pick_variant(png_file, name):
+    """Return the variant `name` of `png_file` if it exists. Otherwise the
+    'full' variant if that exists, else the image itself."""
+    for path in [variant_path(png_file, name), variant_path(png_file, 'full')]:
+        if os.path.exists(path):
+            return path
+    return png_file
+
+
+def variant_url(url, png_file, name):
+    """Return the URL of the variant `name` of `png_file`, given the URL of
+    the image itself. Falls back to `url` if the variant does not exist."""
+    path = pick_variant(png_file, name)
+    if path == png_file:
+        return url
+    return url.rsplit('/', 1)[0] + '/variants/' + os.path.basename(path)
+
+
+def make_variants(png_file, widths=VARIANT_WIDTHS):
+    """Create all variants of `png_file` in parallel from one decoded raster.
+
+    The variants are scaled down from the 'full' variant if it exists,
+    otherwise from the image itself.
+
+    Returns:
+        dict mapping the name of each variant, including 'full', to its filename
+    """
+    source = pick_variant(png_file, 'full')
+    with open(source, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    folder, filename = os.path.split(png_file)
+    stem = os.path.splitext(filename)[0]
+    manifest_file = os.path.join(folder, 'variants', f'{stem}.json')
+    manifest = {'sha256': sha256, 'widths': widths}
+
+    image = Image.open(source)
+    paths = {name: variant_path(png_file, name) for name in widths}
+    paths['full'] = source
+    # variants that would not be smaller than the source are the source itself
+    resize = {name: width for name, width in widths.items() if width < image.width}
+    for name in widths:
+        if name not in resize:
+            paths[name] = source
+
+    if not resize:
+        return paths
+
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            if (json.load(f) == manifest
+                    and all(os.path.exists(paths[name]) for name in resize)):
+                print(f'make_variants: variants of {png_file} are up to date')
+                return paths
+
+    # decode only once, the threads share the raster
+    image.load()
+
+    def save_variant(name):
+        width = resize[name]
+        height = round(image.height * width / image.width)
+        image.resize((width, height), Image.LANCZOS).save(paths[name])
+
+    os.makedirs(os.path.join(folder, 'variants'), exist_ok=True)
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(save_variant, resize))
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+    print(f'make_variants: created {paths}')
+    return paths